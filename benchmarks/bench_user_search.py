@@ -0,0 +1,192 @@
+# Admin user search benchmark
+#
+# Seeds a database with synthetic users, subscriptions and VPN keys, builds the
+# search indexes and times typical admin queries (one page of results plus the
+# capped pagination count). Fails if any query's median exceeds the budget.
+# Searches that stopped walking before the oldest users are marked (partial).
+#
+#   python benchmarks/bench_user_search.py                  # 1M users, temp SQLite
+#   python benchmarks/bench_user_search.py --users 100000
+#   DATABASE_URL=postgresql://... python benchmarks/bench_user_search.py
+#   python benchmarks/bench_user_search.py --skip-seed      # reuse DATABASE_URL data
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.datastructures import MultiDict
+from models import db, User, Subscription, VPNKey, VPNServer
+from search import UserSearchFilters, search_users, paginate_users, ensure_search_indexes
+
+BATCH_SIZE = 50000
+DOMAINS = ('gmail.com', 'yandex.ru', 'mail.ru', 'outlook.com', 'proton.me')
+PLANS = ('free', '1m', '3m')
+
+QUERIES = {
+    'no filters': {},
+    'email prefix': {'q': 'user12345', 'match': 'prefix'},
+    'email substring': {'q': '4242@yan'},
+    'email substring (rare)': {'q': '987654@'},
+    'email substring (broad)': {'q': 'gmail'},
+    'email short (2 chars)': {'q': '77'},
+    'plan 3m + active': {'plan': '3m', 'state': 'active'},
+    'expires in 7 days': {'expires_in': '7'},
+    'expired subscription': {'state': 'expired'},
+    'no subscription': {'state': 'none'},
+    'no active key': {'has_key': 'no'},
+    'server 2': {'server_id': '2'},
+    'email + plan + server': {'q': 'gmail', 'plan': '1m', 'server_id': '3'},
+    # Selective filters: only a few matches, spread over the whole table
+    'email broad, oldest users': {'q': 'user1'},
+    'expires in 1 day': {'expires_in': '1'},
+    'expires in 1 day + server': {'expires_in': '1', 'server_id': '5'},
+    'expires in 1 day, no key': {'expires_in': '1', 'has_key': 'no'},
+    'email + 1 day + server': {'q': 'gmail', 'expires_in': '1', 'server_id': '3'},
+    'lapsed 3m plan': {'plan': '3m', 'state': 'expired'},
+    'lapsed 3m plan + email': {'q': '4242', 'plan': '3m', 'state': 'expired'},
+    # Empty results: nothing to stop a scan early
+    'email no match': {'q': 'zzzz'},
+    'email prefix no match': {'q': 'gmail', 'match': 'prefix'},
+    'server without keys': {'server_id': '99'},
+    'email no match + plan': {'q': 'nobody', 'plan': '1m'},
+    'free plan, no subscription': {'plan': 'free', 'state': 'none'},
+}
+
+
+def create_bench_app(database_url):
+    """Minimal app bound to the benchmark database"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def seed(total_users, servers=5):
+    """Insert synthetic rows in bulk through Core inserts"""
+    rng = random.Random(42)
+    now = datetime.utcnow()
+
+    db.session.execute(db.insert(VPNServer), [
+        {'id': i, 'name': f'Server {i}', 'host': f'10.0.0.{i}', 'max_clients': 1000000,
+         'active_clients': 0, 'is_active': True, 'created_at': now}
+        for i in range(1, servers + 1)
+    ])
+
+    subscription_id = key_id = 0
+    for start in range(1, total_users + 1, BATCH_SIZE):
+        users, subscriptions, keys = [], [], []
+        for user_id in range(start, min(start + BATCH_SIZE, total_users + 1)):
+            users.append({
+                'id': user_id,
+                'email': f'user{user_id}@{rng.choice(DOMAINS)}',
+                'password_hash': 'x',
+                'created_at': now - timedelta(minutes=total_users - user_id),
+                'is_active': True,
+                'is_admin': False,
+            })
+
+            # ~20% of users never subscribed
+            if rng.random() < 0.2:
+                continue
+            plan = rng.choice(PLANS)
+            expires_at = None if plan == 'free' else now + timedelta(days=rng.randint(-60, 90))
+            subscription_id += 1
+            subscriptions.append({
+                'id': subscription_id, 'user_id': user_id, 'plan': plan,
+                'amount_usd': 0 if plan == 'free' else 15, 'created_at': now,
+                'expires_at': expires_at,
+                'is_active': expires_at is None or expires_at > now,
+            })
+
+            if rng.random() < 0.7:
+                key_id += 1
+                keys.append({
+                    'id': key_id, 'user_id': user_id, 'subscription_id': subscription_id,
+                    'token': 'x', 'server_id': rng.randint(1, servers), 'created_at': now,
+                    'expires_at': expires_at, 'is_active': rng.random() < 0.9,
+                })
+
+        db.session.execute(db.insert(User), users)
+        if subscriptions:
+            db.session.execute(db.insert(Subscription), subscriptions)
+        if keys:
+            db.session.execute(db.insert(VPNKey), keys)
+        db.session.commit()
+        print(f'  seeded {min(start + BATCH_SIZE - 1, total_users)} users', flush=True)
+
+
+def time_query(args, repeat):
+    """Median wall time (ms) of the first results page plus its capped count"""
+    filters = UserSearchFilters.from_args(MultiDict(args))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        users = paginate_users(search_users(filters), page=1, per_page=20)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.rollback()
+    total = f"{users.total}{'+' if users.total_is_estimate else ''}"
+    return statistics.median(timings), len(users.items), total, users.is_partial
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark admin user search')
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=50.0)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='keep the rows already in DATABASE_URL')
+    options = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    if options.skip_seed and not database_url:
+        parser.error('--skip-seed needs DATABASE_URL')
+    if not database_url:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+        database_url = f'sqlite:///{path}'
+
+    app = create_bench_app(database_url)
+    with app.app_context():
+        if not options.skip_seed:
+            db.drop_all()
+        db.create_all()
+        ensure_search_indexes(app)
+
+        if not options.skip_seed:
+            print(f'Seeding {options.users} users into {db.engine.dialect.name}...')
+            started = time.perf_counter()
+            seed(options.users)
+            print(f'Seeded in {time.perf_counter() - started:.1f}s')
+        with db.engine.begin() as conn:
+            conn.execute(db.text('ANALYZE'))
+
+        email_index = ('FTS5 trigram' if app.config['USER_SEARCH_FTS'] else
+                       'pg_trgm' if app.config['USER_SEARCH_TRGM'] else 'none (LIKE)')
+        print(f'{User.query.count()} users on {db.engine.dialect.name}, '
+              f'email index: {email_index}\n')
+
+        failed = []
+        print(f"{'query':<28}{'median ms':>10}{'rows':>6}{'total':>10}")
+        for name, args in QUERIES.items():
+            median, rows, total, partial = time_query(args, options.repeat)
+            marker = '' if median <= options.budget_ms else '  SLOW'
+            note = '  (partial)' if partial else ''
+            print(f'{name:<28}{median:>10.1f}{rows:>6}{total:>10}{marker}{note}')
+            if marker:
+                failed.append(name)
+
+    if failed:
+        print(f"\nOver {options.budget_ms:.0f} ms budget: {', '.join(failed)}")
+        sys.exit(1)
+    print(f'\nAll queries within {options.budget_ms:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
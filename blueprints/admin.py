@@ -2,7 +2,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from functools import wraps
+from sqlalchemy.orm import selectinload
 from models import db, User, Subscription, VPNKey, VPNServer, EmailNotification
+from search import UserSearchFilters, search_users, paginate_users
 from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__)
@@ -50,12 +52,17 @@ def index():
 @login_required
 @admin_required
 def users():
-    """Users management"""
+    """Users management with search and filters"""
     page = request.args.get('page', 1, type=int)
-    users = User.query.order_by(User.created_at.desc())\
-                     .paginate(page=page, per_page=20, error_out=False)
+    filters = UserSearchFilters.from_args(request.args)
+    users = paginate_users(search_users(filters).options(selectinload(User.subscriptions)),
+                           page=page, per_page=20)
     
-    return render_template('admin/users.html', users=users)
+    return render_template('admin/users.html',
+                         users=users,
+                         filters=filters,
+                         plans=Subscription.get_plan_details(),
+                         servers=VPNServer.query.order_by(VPNServer.name).all())
 
 @admin_bp.route('/subscriptions')
 @login_required
@@ -8,6 +8,7 @@ from datetime import datetime, timedelta
 import secrets
 
 from models import db, User, Subscription, VPNKey, VPNServer, EmailNotification
+from search import ensure_search_indexes
 
 # Import blueprints
 from blueprints.auth import auth_bp
@@ -65,6 +66,7 @@ def create_app():
     with app.app_context():
         # Create all database tables
         db.create_all()
+        ensure_search_indexes(app)
         
         # Create default admin user if not exists (only in development)
         if app.debug and not User.query.filter_by(is_admin=True).first():
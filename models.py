@@ -19,7 +19,7 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(256), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     last_login = db.Column(db.DateTime)
     is_active = db.Column(db.Boolean, default=True)
     is_admin = db.Column(db.Boolean, default=False)
@@ -51,6 +51,12 @@ class User(UserMixin, db.Model):
 class Subscription(db.Model):
     """User subscription model"""
     __tablename__ = 'subscriptions'
+    __table_args__ = (
+        # Admin user search: "has active subscription / plan / expires within N days"
+        db.Index('ix_subscriptions_user_state', 'user_id', 'is_active', 'expires_at'),
+        db.Index('ix_subscriptions_plan_state', 'plan', 'is_active', 'expires_at', 'user_id'),
+        db.Index('ix_subscriptions_expiry', 'expires_at', 'is_active', 'plan', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -89,6 +95,11 @@ class Subscription(db.Model):
 class VPNKey(db.Model):
     """VPN access keys model"""
     __tablename__ = 'vpn_keys'
+    __table_args__ = (
+        # Admin user search: "has active key / has active key on server"
+        db.Index('ix_vpn_keys_user_active', 'user_id', 'is_active', 'server_id'),
+        db.Index('ix_vpn_keys_active_server', 'is_active', 'server_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -0,0 +1,406 @@
+# Admin user search - email lookup and filters compiled into one query
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
+from models import db, User, Subscription, VPNKey
+
+SUBSCRIPTION_STATES = ('active', 'expired', 'none')
+KEY_STATES = ('yes', 'no')
+MATCH_MODES = ('contains', 'prefix')
+
+# Longer expiry windows are clamped, ids beyond INTEGER columns are dropped
+MAX_EXPIRES_IN_DAYS = 3650
+MAX_ID = 2 ** 31 - 1
+
+# Trigram indexes (pg_trgm / FTS5 trigram) can only help with 3+ characters
+MIN_TRIGRAM_LENGTH = 3
+
+FTS_TABLE = 'users_email_fts'
+_fts_table = db.table(FTS_TABLE, db.column('rowid', db.Integer))
+
+# Filters matching more users than this are too broad to drive the query:
+# walking users newest-first finds a page sooner than materialising them all
+MAX_DRIVER_CANDIDATES = 5000
+
+# Walking users for broad filters stops this many user ids below the newest;
+# when older users exist the results are marked partial ("refine your search")
+MAX_SCANNED_USERS = 50000
+
+# Counting every match of a broad filter on a large table costs more than the
+# page itself, so totals are only exact this many pages past the current one
+COUNTED_PAGES_AHEAD = 10
+
+
+@dataclass
+class UserSearchFilters:
+    """Admin user search parameters parsed from the query string"""
+    q: str = ''
+    match: str = 'contains'
+    plan: str = None
+    state: str = None
+    expires_in: int = None
+    has_key: str = None
+    server_id: int = None
+
+    @classmethod
+    def from_args(cls, args):
+        """Build filters from request args, silently dropping invalid values"""
+        filters = cls()
+        filters.q = (args.get('q') or '').strip()
+
+        match = args.get('match')
+        if match in MATCH_MODES:
+            filters.match = match
+
+        plan = args.get('plan')
+        if plan in Subscription.get_plan_details():
+            filters.plan = plan
+
+        state = args.get('state')
+        if state in SUBSCRIPTION_STATES:
+            filters.state = state
+
+        expires_in = args.get('expires_in', type=int)
+        if expires_in is not None and expires_in > 0:
+            filters.expires_in = min(expires_in, MAX_EXPIRES_IN_DAYS)
+
+        has_key = args.get('has_key')
+        if has_key in KEY_STATES:
+            filters.has_key = has_key
+
+        server_id = args.get('server_id', type=int)
+        if server_id is not None and 0 < server_id <= MAX_ID:
+            filters.server_id = server_id
+        return filters
+
+    def to_args(self):
+        """Non-empty filters as query string arguments (for pagination links)"""
+        args = {
+            'q': self.q,
+            'plan': self.plan,
+            'state': self.state,
+            'expires_in': self.expires_in,
+            'has_key': self.has_key,
+            'server_id': self.server_id,
+        }
+        args = {key: value for key, value in args.items() if value}
+        if self.q and self.match != 'contains':
+            args['match'] = self.match
+        return args
+
+    def is_empty(self):
+        """Check if no filter is set"""
+        return not self.to_args()
+
+
+def _escape_like(value):
+    """Escape LIKE wildcards in user input"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _email_condition(filters):
+    """Case-insensitive prefix/substring email match"""
+    escaped = _escape_like(filters.q.lower())
+    pattern = f'{escaped}%' if filters.match == 'prefix' else f'%{escaped}%'
+    return db.func.lower(User.email).like(pattern, escape='\\')
+
+
+def _email_filter(filters):
+    """Email condition and the subquery of users it can match
+
+    The subquery comes from an email index: the lower(email) index for
+    prefixes, FTS5 or pg_trgm for substrings. It is exact when it repeats
+    the LIKE condition, otherwise LIKE still has to be checked per user.
+    """
+    condition = _email_condition(filters)
+    term = filters.q.lower()
+    dialect = db.engine.dialect.name
+
+    if filters.match == 'prefix':
+        if dialect == 'sqlite':
+            # SQLite won't use the lower(email) index for LIKE, only for a range
+            upper = term[:-1] + chr(ord(term[-1]) + 1)
+            email = db.func.lower(User.email)
+            return [condition], db.select(User.id).where(email >= term, email < upper), False
+        if dialect == 'postgresql':
+            return [condition], db.select(User.id).where(condition), True
+
+    if len(term) >= MIN_TRIGRAM_LENGTH:
+        if current_app.config.get('USER_SEARCH_FTS'):
+            return [condition], db.select(_fts_table.c.rowid).where(_fts_match(term)), False
+        if current_app.config.get('USER_SEARCH_TRGM'):
+            return [condition], db.select(User.id).where(condition), True
+    return [condition], None, False
+
+
+def _fts_match(term):
+    """FTS5 MATCH clause for the term as a phrase"""
+    phrase = '"' + term.replace('"', '""') + '"'
+    return text(f'{FTS_TABLE} MATCH :email_fts').bindparams(email_fts=phrase)
+
+
+def _subscription_filter(filters, now):
+    """Subscription conditions and the subquery of users they can match, if exact
+
+    Plan and expiry window apply to the current subscription, except for
+    lapsed users where the plan is the one of their last subscription.
+    """
+    any_subscription = Subscription.user_id == User.id
+
+    if filters.state == 'none':
+        if filters.plan or filters.expires_in:
+            # Users without subscriptions have neither a plan nor an expiry date
+            return [db.false()], None, False
+        return [~db.exists().where(any_subscription)], None, False
+
+    live = [Subscription.is_active.is_(True)]
+    if filters.expires_in:
+        if filters.state == 'expired':
+            # The window looks ahead, lapsed subscriptions already expired
+            return [db.false()], None, False
+        live.append(Subscription.expires_at > now)
+        live.append(Subscription.expires_at <= now + timedelta(days=filters.expires_in))
+    else:
+        live.append(db.or_(Subscription.expires_at.is_(None), Subscription.expires_at > now))
+
+    if filters.state == 'expired':
+        lapsed = [db.or_(Subscription.is_active.is_(False), Subscription.expires_at <= now)]
+        conditions = [~db.exists().where(any_subscription, *live)]
+        if filters.plan:
+            # A last plan also implies the user has subscriptions at all
+            lapsed.append(Subscription.plan == filters.plan)
+            last_plan = db.select(Subscription.plan).where(any_subscription)\
+                .order_by(Subscription.created_at.desc(), Subscription.id.desc())\
+                .limit(1).scalar_subquery()
+            conditions.append(last_plan == filters.plan)
+        else:
+            conditions.append(db.exists().where(any_subscription))
+        return conditions, db.select(Subscription.user_id).where(*lapsed), False
+
+    if filters.plan:
+        live.append(Subscription.plan == filters.plan)
+    if filters.plan or filters.expires_in or filters.state == 'active':
+        return [db.exists().where(any_subscription, *live)], \
+            db.select(Subscription.user_id).where(*live), True
+    return [], None, False
+
+
+def _key_filter(filters):
+    """Active VPN key conditions and the subquery of users they can match, if exact"""
+    any_key = VPNKey.user_id == User.id
+    active = [VPNKey.is_active.is_(True)]
+
+    wants_key = filters.server_id or filters.has_key == 'yes'
+    if wants_key and filters.state == 'none':
+        # Keys are only issued for one of the user's subscriptions
+        return [db.false()], None, False
+
+    if filters.server_id:
+        if filters.has_key == 'no':
+            # "No active key" and "active key on server" exclude each other
+            return [db.false()], None, False
+        active.append(VPNKey.server_id == filters.server_id)
+    elif filters.has_key == 'no':
+        return [~db.exists().where(any_key, *active)], None, False
+    elif filters.has_key != 'yes':
+        return [], None, False
+
+    return [db.exists().where(any_key, *active)], db.select(VPNKey.user_id).where(*active), True
+
+
+def _selective_candidates(candidates):
+    """Position of the smallest candidate subquery within MAX_DRIVER_CANDIDATES rows"""
+    best, best_count = None, None
+    for position, candidate in enumerate(candidates):
+        if candidate is None:
+            continue
+        probe = candidate.limit(MAX_DRIVER_CANDIDATES + 1).subquery()
+        count = db.session.execute(db.select(db.func.count()).select_from(probe)).scalar()
+        if count <= MAX_DRIVER_CANDIDATES and (best_count is None or count < best_count):
+            best, best_count = position, count
+            if not count:
+                break
+    return best
+
+
+def _id_in(candidates):
+    """users.id IN candidates, written so the candidates drive the query"""
+    if db.engine.dialect.name == 'postgresql':
+        # PostgreSQL may turn IN into a semi-join that walks users_pkey and
+        # probes the candidates; an ARRAY is built once and looked up by id
+        return User.id == db.any_(db.func.array(candidates.scalar_subquery()))
+    return User.id.in_(candidates)
+
+
+def search_users(filters):
+    """Build a single users query (newest first) for the given filters
+
+    Each filter adds conditions checked per user and, when it can list the
+    users it may match up front, a candidate subquery. Those are probed with
+    a LIMIT and the smallest selective one drives the query through
+    ``users.id IN (...)``, replacing its filter's conditions when it is exact.
+    When every filter is broad, users are walked newest-first (through the
+    FTS index for an email term) until a page of matches is found, but no
+    further than MAX_SCANNED_USERS ids below the newest user.
+    """
+    now = datetime.utcnow()
+    groups = [_subscription_filter(filters, now), _key_filter(filters)]
+    if filters.q:
+        groups.insert(0, _email_filter(filters))
+
+    driver = _selective_candidates([candidates for _, candidates, _ in groups])
+    query = User.query
+    for position, (conditions, candidates, exact) in enumerate(groups):
+        if position == driver:
+            query = query.filter(_id_in(candidates))
+            if exact:
+                continue
+        query = query.filter(*conditions)
+
+    conditions = [condition for group, _, _ in groups for condition in group]
+    if driver is not None or not conditions or any(c is db.false() for c in conditions):
+        # Nothing to walk past: candidates are few, every user or no user matches
+        return query.order_by(User.id.desc())
+
+    floor = _scan_floor()
+    if floor is not None:
+        query = query.filter(User.id > floor).execution_options(user_search_floor=floor)
+    if current_app.config.get('USER_SEARCH_FTS') and len(filters.q) >= MIN_TRIGRAM_LENGTH:
+        # Stream FTS matches in rowid order instead of materialising them
+        query = query.join(_fts_table, _fts_table.c.rowid == User.id)\
+            .filter(_fts_match(filters.q.lower()))
+        if floor is not None:
+            query = query.filter(_fts_table.c.rowid > floor)
+        return query.order_by(_fts_table.c.rowid.desc())
+    return query.order_by(User.id.desc())
+
+
+def _scan_floor():
+    """User id a walk stops at, None when the whole table is within MAX_SCANNED_USERS"""
+    newest = db.session.execute(db.select(db.func.max(User.id))).scalar() or 0
+    floor = newest - MAX_SCANNED_USERS
+    return floor if floor > 0 else None
+
+
+def paginate_users(query, page, per_page=20):
+    """Paginate a search query with a capped total count
+
+    ``total_is_estimate`` is set when there are more matches than were counted.
+    ``is_partial`` is set when the search stopped before the oldest users and
+    found too few matches to fill the counted pages, so some may be missing.
+    """
+    users = query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+
+    limit = (users.page + COUNTED_PAGES_AHEAD) * per_page + 1
+    if users.items and len(users.items) < per_page or users.page == 1 and not users.items:
+        # The last page is already loaded, nothing left to count
+        users.total = (users.page - 1) * per_page + len(users.items)
+    else:
+        # Counted in result order, so a walk stays within the ids it may scan
+        counted = query.limit(limit).subquery()
+        users.total = db.session.execute(
+            db.select(db.func.count()).select_from(counted)
+        ).scalar()
+
+    floor = query.get_execution_options().get('user_search_floor')
+    users.is_partial = floor is not None and users.total < limit
+    users.total_is_estimate = users.total >= limit or users.is_partial
+    return users
+
+
+def ensure_search_indexes(app):
+    """Create the indexes user search relies on (idempotent)
+
+    Model indexes are created with IF NOT EXISTS so databases created before
+    they were declared pick them up too. Email search gets a pg_trgm GIN index
+    on PostgreSQL and an FTS5 trigram table kept in sync by triggers on SQLite;
+    without them it falls back to LIKE scans. Both also index lower(email)
+    for prefix searches.
+    """
+    engine = db.engine
+    app.config['USER_SEARCH_FTS'] = False
+    app.config['USER_SEARCH_TRGM'] = False
+
+    with engine.begin() as conn:
+        for model in (User, Subscription, VPNKey):
+            for index in model.__table__.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+    if engine.dialect.name == 'postgresql':
+        app.config['USER_SEARCH_TRGM'] = _ensure_postgres_trigram(engine)
+    elif engine.dialect.name == 'sqlite':
+        with engine.begin() as conn:
+            conn.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_users_email_lower ON users (lower(email))'
+            ))
+        app.config['USER_SEARCH_FTS'] = _ensure_sqlite_fts(engine)
+
+
+def _ensure_postgres_trigram(engine):
+    """Create the lower(email) prefix and trigram indexes, False if pg_trgm is unavailable"""
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE INDEX IF NOT EXISTS ix_users_email_lower_prefix '
+            'ON users (lower(email) text_pattern_ops)'
+        ))
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+            conn.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_users_email_trgm '
+                'ON users USING gin (lower(email) gin_trgm_ops)'
+            ))
+        return True
+    except Exception as e:
+        # Extension not installed or the role may not create extensions
+        print(f"User search trigram index unavailable, falling back to LIKE: {e}")
+        return False
+
+
+def _ensure_sqlite_fts(engine):
+    """Create the FTS5 trigram email table and its triggers, False if unsupported
+
+    Dropping ``users`` drops the triggers but keeps the FTS table, so missing
+    triggers are recreated and the index is rebuilt from the current rows.
+    """
+    triggers = {
+        f'{FTS_TABLE}_ai': (
+            f"AFTER INSERT ON users BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, email) VALUES (new.id, new.email); END"
+        ),
+        f'{FTS_TABLE}_ad': (
+            f"AFTER DELETE ON users BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email) "
+            f"VALUES ('delete', old.id, old.email); END"
+        ),
+        f'{FTS_TABLE}_au': (
+            f"AFTER UPDATE OF email ON users BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, email) "
+            f"VALUES ('delete', old.id, old.email); "
+            f"INSERT INTO {FTS_TABLE}(rowid, email) VALUES (new.id, new.email); END"
+        ),
+    }
+    try:
+        with engine.begin() as conn:
+            existing = set(conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+            )).scalars())
+            if FTS_TABLE in existing and existing.issuperset(triggers):
+                return True
+
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"email, content='users', content_rowid='id', tokenize='trigram')"
+            ))
+            for name, body in triggers.items():
+                conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+                conn.execute(text(f"CREATE TRIGGER {name} {body}"))
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        return True
+    except Exception as e:
+        # SQLite built without FTS5 or older than 3.34 (no trigram tokenizer)
+        print(f"User search FTS unavailable, falling back to LIKE: {e}")
+        return False
@@ -0,0 +1,225 @@
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import search
+from models import db, User, Subscription, VPNKey, VPNServer
+from search import UserSearchFilters, search_users, paginate_users, ensure_search_indexes
+
+
+def add_user(email, subscriptions=(), keys=()):
+    """Add a user with (plan, days_until_expiry, is_active) subscriptions, oldest
+    first, and (server_id, is_active) keys issued for the last one"""
+    now = datetime.utcnow()
+    user = User(email=email, password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+
+    for age, (plan, expires_in, is_active) in enumerate(subscriptions):
+        subscription = Subscription(
+            user_id=user.id,
+            plan=plan,
+            amount_usd=0,
+            created_at=now - timedelta(days=len(subscriptions) - age),
+            expires_at=None if expires_in is None else now + timedelta(days=expires_in),
+            is_active=is_active,
+        )
+        db.session.add(subscription)
+        db.session.flush()
+
+    for server_id, is_active in keys:
+        db.session.add(VPNKey(user_id=user.id, subscription_id=subscription.id, token='x',
+                              server_id=server_id, is_active=is_active))
+    return user
+
+
+@pytest.fixture
+def users(app):
+    db.session.add_all([VPNServer(id=1, name='A', host='a'), VPNServer(id=2, name='B', host='b')])
+    add_user('active.1m@example.com', [('1m', 20, True)], keys=[(1, True)])
+    add_user('soon.3m@example.com', [('3m', 2, True)], keys=[(2, True)])
+    add_user('free@example.com', [('free', None, True)])
+    add_user('lapsed.3m@example.com', [('3m', -5, False)], keys=[(1, False)])
+    add_user('lapsed.1m@example.com', [('3m', -60, False), ('1m', -3, True)])
+    add_user('renewed@example.com', [('3m', -30, False), ('1m', 50, True)], keys=[(2, True)])
+    add_user('nosub@example.com')
+    add_user('under_score@test.org')
+    add_user('underXscore@test.org')
+    add_user('per%cent@test.org')
+    add_user('Mixed.Case@Example.COM')
+    db.session.commit()
+
+
+def emails(**args):
+    filters = UserSearchFilters.from_args(MultiDict(args))
+    return [user.email for user in search_users(filters).all()]
+
+
+@pytest.mark.parametrize('args, expected', [
+    ({'state': 'active'}, {'active.1m', 'soon.3m', 'free', 'renewed'}),
+    ({'state': 'expired'}, {'lapsed.3m', 'lapsed.1m'}),
+    ({'plan': '3m'}, {'soon.3m'}),
+    ({'plan': '1m', 'state': 'active'}, {'active.1m', 'renewed'}),
+    ({'plan': '3m', 'state': 'expired'}, {'lapsed.3m'}),
+    ({'plan': '1m', 'state': 'expired'}, {'lapsed.1m'}),
+    ({'expires_in': '7'}, {'soon.3m'}),
+    ({'expires_in': '30', 'plan': '1m'}, {'active.1m'}),
+    ({'has_key': 'yes'}, {'active.1m', 'soon.3m', 'renewed'}),
+    ({'server_id': '2'}, {'soon.3m', 'renewed'}),
+    ({'server_id': '1', 'state': 'active'}, {'active.1m'}),
+    ({'has_key': 'no', 'state': 'expired'}, {'lapsed.3m', 'lapsed.1m'}),
+])
+def test_subscription_and_key_filters(users, args, expected):
+    assert {email.split('@')[0] for email in emails(**args)} == expected
+
+
+def test_no_subscription_state(users):
+    assert set(emails(state='none')) == {
+        'nosub@example.com', 'under_score@test.org', 'underXscore@test.org',
+        'per%cent@test.org', 'Mixed.Case@Example.COM',
+    }
+
+
+@pytest.mark.parametrize('args', [
+    {'plan': 'free', 'state': 'none'},
+    {'expires_in': '30', 'state': 'none'},
+    {'expires_in': '30', 'state': 'expired'},
+    {'server_id': '1', 'has_key': 'no'},
+    {'has_key': 'yes', 'state': 'none'},
+])
+def test_impossible_combinations_match_nothing(users, args):
+    assert emails(**args) == []
+
+
+@pytest.mark.parametrize('q, match, expected', [
+    ('_', 'contains', ['under_score@test.org']),
+    ('%', 'contains', ['per%cent@test.org']),
+    ('r_s', 'contains', ['under_score@test.org']),
+    ('MIXED.case@', 'contains', ['Mixed.Case@Example.COM']),
+    ('under', 'prefix', ['underXscore@test.org', 'under_score@test.org']),
+    ('score', 'prefix', []),
+    ('score', 'contains', ['underXscore@test.org', 'under_score@test.org']),
+])
+def test_email_search(users, q, match, expected):
+    assert emails(q=q, match=match) == expected
+
+
+# Every combination is run through each query plan: driven by a candidate
+# subquery or walking users, with and without the SQLite FTS index
+FILTER_COMBINATIONS = [
+    {},
+    {'q': 'example'},
+    {'q': 'exa', 'match': 'prefix'},
+    {'q': 'lapsed', 'state': 'expired'},
+    {'q': 'example', 'plan': '3m', 'state': 'expired'},
+    {'q': 'Example.com', 'has_key': 'yes'},
+    {'q': '.3m', 'server_id': '2'},
+    {'q': 'test', 'state': 'none'},
+    {'q': 'ex', 'expires_in': '60'},
+    {'plan': '1m', 'server_id': '2'},
+    {'state': 'active', 'has_key': 'no'},
+    {'q': 'nobody'},
+]
+
+
+@pytest.mark.parametrize('args', FILTER_COMBINATIONS)
+def test_query_plans_return_the_same_rows(app, users, monkeypatch, args):
+    results = []
+    for fts in (True, False):
+        for max_candidates in (-1, 10 ** 6):
+            monkeypatch.setitem(app.config, 'USER_SEARCH_FTS', fts)
+            monkeypatch.setattr(search, 'MAX_DRIVER_CANDIDATES', max_candidates)
+            results.append(emails(**args))
+
+    assert all(result == results[0] for result in results)
+
+
+def test_results_are_newest_first(users):
+    ids = [user.id for user in search_users(UserSearchFilters()).all()]
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_fts_index_follows_user_changes(app, users):
+    user = User.query.filter_by(email='nosub@example.com').one()
+    user.email = 'renamed@example.com'
+    db.session.add(User(email='fresh@example.com', password_hash='x'))
+    db.session.commit()
+    assert emails(q='renamed') == ['renamed@example.com']
+    assert emails(q='fresh') == ['fresh@example.com']
+    assert emails(q='nosub') == []
+
+    db.session.delete(user)
+    db.session.commit()
+    assert emails(q='renamed') == []
+
+
+def test_fts_triggers_are_restored_after_recreating_tables(app, users):
+    db.session.remove()
+    db.drop_all()
+    db.create_all()
+    ensure_search_indexes(app)
+    assert app.config['USER_SEARCH_FTS']
+
+    db.session.add(User(email='alice@example.com', password_hash='x'))
+    db.session.commit()
+    assert emails(q='alice') == ['alice@example.com']
+    assert emails(q='example') == ['alice@example.com']
+
+
+def test_filters_keep_the_typed_term_and_drop_invalid_values():
+    filters = UserSearchFilters.from_args(MultiDict({
+        'q': '  Alice@Example ', 'match': 'prefix', 'plan': 'lifetime',
+        'state': 'paused', 'expires_in': '-3', 'has_key': 'maybe', 'server_id': 'x',
+    }))
+    assert filters.q == 'Alice@Example'
+    assert filters.to_args() == {'q': 'Alice@Example', 'match': 'prefix'}
+    assert UserSearchFilters().is_empty()
+
+
+@pytest.mark.parametrize('args, expected', [
+    ({'expires_in': '3000000'}, {'expires_in': 3650}),
+    ({'expires_in': '9' * 30}, {'expires_in': 3650}),
+    ({'server_id': str(2 ** 63)}, {}),
+    ({'server_id': '0'}, {}),
+])
+def test_filters_keep_numbers_in_range(users, args, expected):
+    filters = UserSearchFilters.from_args(MultiDict(args))
+    assert filters.to_args() == expected
+    search_users(filters).all()
+
+
+def test_paginate_users_caps_the_total(app, monkeypatch):
+    db.session.add_all(User(email=f'user{i}@example.com', password_hash='x') for i in range(30))
+    db.session.commit()
+
+    monkeypatch.setattr(search, 'COUNTED_PAGES_AHEAD', 1)
+    users = paginate_users(search_users(UserSearchFilters()), page=1, per_page=5)
+    assert len(users.items) == 5
+    assert users.total == 11 and users.total_is_estimate
+
+    users = paginate_users(search_users(UserSearchFilters()), page=6, per_page=5)
+    assert users.total == 30 and not users.total_is_estimate
+
+    users = paginate_users(search_users(UserSearchFilters()), page=-50, per_page=5)
+    assert users.page == 1 and len(users.items) == 5
+    assert users.total == 11 and users.total_is_estimate
+
+
+@pytest.mark.parametrize('fts', [True, False])
+def test_walk_stops_at_the_newest_users(app, users, monkeypatch, fts):
+    monkeypatch.setitem(app.config, 'USER_SEARCH_FTS', fts)
+    monkeypatch.setattr(search, 'MAX_DRIVER_CANDIDATES', -1)
+    monkeypatch.setattr(search, 'MAX_SCANNED_USERS', 4)
+
+    users = paginate_users(search_users(UserSearchFilters(q='example')), page=1)
+    assert [user.email for user in users.items] == ['Mixed.Case@Example.COM']
+    assert users.total == 1 and users.is_partial and users.total_is_estimate
+
+    impossible = UserSearchFilters(plan='free', state='none')
+    users = paginate_users(search_users(impossible), page=1)
+    assert users.total == 0 and not users.is_partial
+
+    monkeypatch.setattr(search, 'MAX_SCANNED_USERS', 11)
+    users = paginate_users(search_users(UserSearchFilters(q='example')), page=1)
+    assert users.total == 8 and not users.is_partial and not users.total_is_estimate